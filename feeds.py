@@ -0,0 +1,207 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import xml.etree.ElementTree as ET
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for a datamart server before giving up on a feed
+REQUEST_TIMEOUT = 20
+
+ATOM_NS = '{http://www.w3.org/2005/Atom}'
+CAP_NS = '{urn:oasis:names:tc:emergency:cap:1.2}'
+
+
+class Feed:
+    """A datamart source: where to fetch it, how to parse it and how long a copy stays fresh."""
+
+    def __init__(self, name, url, parser, ttl, required=False):
+        self.name = name
+        self.url = url
+        self.parser = parser
+        self.ttl = ttl  # seconds
+        self.required = required  # if True, a failed fetch with no cached copy aborts the cycle
+
+
+# Registered feeds, keyed by name
+FEEDS = {}
+
+# In-memory cache of {name: (fetched_at, parsed)} for long-running processes
+_memory_cache = {}
+
+# Shared HTTP session so concurrent fetches reuse pooled connections to dd.weather.gc.ca
+_session = None
+
+
+def register_feed(name, url, parser, ttl, required=False):
+    """Adds a feed to the registry. Feeds without a URL are skipped."""
+    if not url:
+        return None
+    feed = Feed(name, url, parser, ttl, required)
+    FEEDS[name] = feed
+    return feed
+
+
+def get_session():
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+        _session.mount('http://', adapter)
+        _session.mount('https://', adapter)
+    return _session
+
+
+def _cache_path(cache_dir, feed):
+    return os.path.join(cache_dir, f"feed_{feed.name}.xml")
+
+
+def _read_disk_cache(cache_dir, feed):
+    """Returns (fetched_at, raw content) from the on-disk cache, or (None, None)."""
+    path = _cache_path(cache_dir, feed)
+    try:
+        fetched_at = os.path.getmtime(path)
+        with open(path, 'rb') as cache_file:
+            return fetched_at, cache_file.read()
+    except OSError:
+        return None, None
+
+
+def _write_disk_cache(cache_dir, feed, content):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _cache_path(cache_dir, feed)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as cache_file:
+        cache_file.write(content)
+    # Rename so a crash mid-write never leaves a truncated feed behind
+    os.replace(tmp_path, path)
+
+
+def _download(feed):
+    response = get_session().get(feed.url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.content
+
+
+def fetch_feeds(cache_dir, names=None, now=None, use_cache=True):
+    """Returns {name: parsed data} for the registered feeds.
+
+    Feeds whose cached copy is older than their TTL are downloaded concurrently; the rest
+    are served from the in-memory or on-disk cache. A failed download falls back to a stale
+    cached copy when there is one. With use_cache=False every feed is downloaded.
+    """
+    now = time.time() if now is None else now
+    feeds = [FEEDS[name] for name in (names or FEEDS) if name in FEEDS]
+    results = {}
+    stale = {}
+    due = []
+
+    for feed in feeds:
+        if not use_cache:
+            due.append(feed)
+            continue
+
+        cached = _memory_cache.get(feed.name)
+        if cached is not None and now - cached[0] < feed.ttl:
+            results[feed.name] = cached[1]
+            continue
+
+        fetched_at, content = _read_disk_cache(cache_dir, feed)
+        if content is not None:
+            try:
+                parsed = feed.parser(content)
+            except Exception as e:
+                logging.warning(f"Discarding unreadable cached copy of feed '{feed.name}': {e}")
+            else:
+                if now - fetched_at < feed.ttl:
+                    _memory_cache[feed.name] = (fetched_at, parsed)
+                    results[feed.name] = parsed
+                    continue
+                stale[feed.name] = parsed
+        due.append(feed)
+
+    if due:
+        with ThreadPoolExecutor(max_workers=len(due)) as executor:
+            downloads = {feed.name: executor.submit(_download, feed) for feed in due}
+
+        for feed in due:
+            try:
+                content = downloads[feed.name].result()
+                parsed = feed.parser(content)
+            except Exception as e:
+                if feed.name in stale:
+                    logging.warning(f"Failed to fetch feed '{feed.name}', using stale copy: {e}")
+                    results[feed.name] = stale[feed.name]
+                    continue
+                if feed.required:
+                    logging.error(f"Failed to fetch feed '{feed.name}': {e}")
+                    raise
+                # An optional feed only drops its part of the alerts band
+                logging.warning(f"Failed to fetch optional feed '{feed.name}': {e}")
+                results[feed.name] = None
+                continue
+
+            try:
+                _write_disk_cache(cache_dir, feed, content)
+            except OSError as e:
+                logging.warning(f"Failed to cache feed '{feed.name}': {e}")
+            _memory_cache[feed.name] = (now, parsed)
+            results[feed.name] = parsed
+            logging.info(f"Feed '{feed.name}' fetched successfully.")
+
+    return results
+
+
+# Parsers for the datamart feeds
+
+def parse_citypage(content):
+    """Citypage weather XML. Returns the root element for process_weather_data."""
+    return ET.fromstring(content)
+
+
+def parse_aqhi(content):
+    """AQHI observation XML. Returns the current index as a float, or None."""
+    root = ET.fromstring(content)
+    index = root.find('.//airQualityHealthIndex')
+    if index is None or not (index.text or '').strip():
+        return None
+    return float(index.text)
+
+
+def parse_marine(content):
+    """Marine weather XML. Returns the list of warning names in effect."""
+    root = ET.fromstring(content)
+    warnings_list = []
+    for event in root.iter('event'):
+        name = event.get('name') or (event.text or '').strip()
+        if name and name not in warnings_list:
+            warnings_list.append(name)
+    return warnings_list
+
+
+def parse_alert_details(content):
+    """CAP alert or ATOM alert feed. Returns the list of English headlines."""
+    root = ET.fromstring(content)
+    headlines = []
+
+    # CAP alert message
+    for info in root.iter(f'{CAP_NS}info'):
+        language = info.find(f'{CAP_NS}language')
+        if language is not None and not (language.text or '').startswith('en'):
+            continue
+        headline = info.find(f'{CAP_NS}headline')
+        if headline is not None and headline.text:
+            headlines.append(headline.text.strip())
+
+    # ATOM alert feed (one entry per warning, plus a placeholder when there is none)
+    for entry in root.iter(f'{ATOM_NS}entry'):
+        title = entry.find(f'{ATOM_NS}title')
+        if title is None or not title.text:
+            continue
+        text = title.text.strip()
+        if text.lower().startswith('no watches or warnings'):
+            continue
+        headlines.append(text.split(',')[0])
+
+    return headlines
@@ -0,0 +1,293 @@
+import os
+import mmap
+import zlib
+import struct
+import logging
+from PIL import Image, GifImagePlugin
+
+# Index file: a header followed by fixed-size records, one per frame
+INDEX_MAGIC = b'EPDFIDX1'
+INDEX_HEADER = struct.Struct('<8sHH')  # magic, frame width, frame height
+INDEX_RECORD = struct.Struct('<dQIB3x')  # timestamp, offset in log, compressed length, flags
+
+# Sidecar with the most recent frame, so appends can delta against it without decoding the log
+LAST_FRAME_HEADER = struct.Struct('<Q')  # number of frames in the archive when it was written
+
+KEYFRAME = 0x01  # record holds the whole frame rather than a delta from the previous one
+
+# Store a whole frame every N frames so random access never decodes more than N deltas
+KEYFRAME_INTERVAL = 96
+
+
+def _xor(a, b):
+    """XORs two equal-length frames; unchanged pixels become zero bytes that compress well."""
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b, 'big')).to_bytes(len(a), 'big')
+
+
+class FrameArchive:
+    """Append-only archive of packed 1-bit frames.
+
+    Frames are zlib-compressed into '<path>.log', each as an XOR delta against the previous
+    frame except for periodic keyframes. '<path>.idx' holds one fixed-size record per frame,
+    so both files can be memory-mapped and searched by timestamp without reading them whole.
+    '<path>.last' keeps a compressed copy of the newest frame for the next append.
+    """
+
+    def __init__(self, path, width, height):
+        self.log_path = path + '.log'
+        self.index_path = path + '.idx'
+        self.last_path = path + '.last'
+        self.width = width
+        self.height = height
+        self.frame_size = width * height // 8
+        # (frame count, newest frame) kept by a long-running process
+        self._last = None
+
+    # Writing
+
+    def _read_header(self, index_file):
+        header = index_file.read(INDEX_HEADER.size)
+        magic, width, height = INDEX_HEADER.unpack(header)
+        if magic != INDEX_MAGIC or (width, height) != (self.width, self.height):
+            raise ValueError(f"{self.index_path} is not a {self.width}x{self.height} frame index")
+
+    def _frame_count(self):
+        try:
+            size = os.path.getsize(self.index_path)
+        except OSError:
+            return 0
+        return max(0, size - INDEX_HEADER.size) // INDEX_RECORD.size
+
+    def _previous_frame(self, count):
+        """Returns the newest archived frame, or None if it cannot be recovered."""
+        if self._last is not None and self._last[0] == count:
+            return self._last[1]
+
+        try:
+            with open(self.last_path, 'rb') as last_file:
+                data = last_file.read()
+            (last_count,) = LAST_FRAME_HEADER.unpack_from(data)
+            if last_count == count:
+                last_frame = zlib.decompress(data[LAST_FRAME_HEADER.size:])
+                if len(last_frame) == self.frame_size:
+                    return last_frame
+        except (OSError, struct.error, zlib.error):
+            pass
+
+        # The sidecar is missing or stale, so decode the frame from the log
+        with self.reader() as reader:
+            try:
+                return reader.frame(count - 1)
+            except (zlib.error, ValueError, IndexError) as e:
+                # Start over from a keyframe rather than chaining deltas onto a damaged record
+                logging.warning(f"Previous archived frame is unreadable, writing a keyframe: {e}")
+                return None
+
+    def _save_last_frame(self, count, frame):
+        self._last = (count, frame)
+        try:
+            # Compressed, since this file is rewritten on every update
+            with open(self.last_path + '.tmp', 'wb') as last_file:
+                last_file.write(LAST_FRAME_HEADER.pack(count) + zlib.compress(frame))
+            os.replace(self.last_path + '.tmp', self.last_path)
+        except OSError as e:
+            logging.warning(f"Failed to save last archived frame: {e}")
+
+    def append(self, timestamp, frame):
+        """Adds a packed frame to the end of the archive."""
+        if len(frame) != self.frame_size:
+            raise ValueError(f"Packed frame is {len(frame)} bytes, expected {self.frame_size}")
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+
+        count = self._frame_count()
+        previous = None
+        if count and count % KEYFRAME_INTERVAL:
+            previous = self._previous_frame(count)
+
+        if previous is None:
+            flags, payload = KEYFRAME, frame
+        else:
+            flags, payload = 0, _xor(frame, previous)
+        data = zlib.compress(payload, 9)
+
+        # Data goes first and is synced: a crash before the index record is written only
+        # leaves unreferenced bytes, never an index record pointing at unwritten data
+        with open(self.log_path, 'ab') as log_file:
+            offset = log_file.seek(0, os.SEEK_END)
+            log_file.write(data)
+            log_file.flush()
+            os.fsync(log_file.fileno())
+
+        with open(self.index_path, 'ab+') as index_file:
+            size = index_file.seek(0, os.SEEK_END)
+            if size == 0:
+                index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.width, self.height))
+            else:
+                index_file.seek(0)
+                self._read_header(index_file)
+                # Drop a partial record left by an interrupted write
+                records_end = INDEX_HEADER.size + (size - INDEX_HEADER.size) // INDEX_RECORD.size * INDEX_RECORD.size
+                if records_end != size:
+                    index_file.truncate(records_end)
+            index_file.write(INDEX_RECORD.pack(timestamp, offset, len(data), flags))
+
+        self._save_last_frame(count + 1, bytes(frame))
+
+    # Reading
+
+    def reader(self):
+        return FrameArchiveReader(self)
+
+
+class FrameArchiveReader:
+    """Memory-mapped random access to an archive. Use as a context manager."""
+
+    def __init__(self, archive):
+        self.archive = archive
+        self._files = []
+        self._index = None
+        self._log = None
+        self._count = 0
+        # Last decoded frame, so sequential reads apply one delta each
+        self._cached_position = None
+        self._cached_frame = None
+
+    def __enter__(self):
+        self._index = self._map(self.archive.index_path)
+        self._log = self._map(self.archive.log_path)
+        if self._index is not None:
+            if len(self._index) < INDEX_HEADER.size:
+                raise ValueError(f"{self.archive.index_path} is truncated")
+            magic, width, height = INDEX_HEADER.unpack_from(self._index, 0)
+            if magic != INDEX_MAGIC or (width, height) != (self.archive.width, self.archive.height):
+                raise ValueError(f"{self.archive.index_path} is not a {self.archive.width}x{self.archive.height} frame index")
+            self._count = (len(self._index) - INDEX_HEADER.size) // INDEX_RECORD.size
+        return self
+
+    def __exit__(self, *exc_info):
+        for mapped in (self._index, self._log):
+            if mapped is not None:
+                mapped.close()
+        for open_file in self._files:
+            open_file.close()
+        self._files = []
+
+    def _map(self, path):
+        try:
+            open_file = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        self._files.append(open_file)
+        if os.fstat(open_file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(open_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self._count
+
+    def record(self, position):
+        """Returns (timestamp, offset, length, flags) for the frame at position."""
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        return INDEX_RECORD.unpack_from(self._index, INDEX_HEADER.size + position * INDEX_RECORD.size)
+
+    def timestamp(self, position):
+        return self.record(position)[0]
+
+    def _payload(self, position):
+        _, offset, length, flags = self.record(position)
+        return flags, zlib.decompress(self._log[offset:offset + length])
+
+    def frame(self, position):
+        """Returns the packed frame at position, decoding from the nearest earlier keyframe."""
+        if position == self._cached_position:
+            return self._cached_frame
+
+        keyframe = position
+        while not self.record(keyframe)[3] & KEYFRAME:
+            keyframe -= 1
+        # Continue from the cached frame when it lies between the keyframe and position
+        if self._cached_position is not None and keyframe <= self._cached_position < position:
+            start, frame = self._cached_position + 1, self._cached_frame
+        else:
+            start, frame = keyframe, None
+
+        for current in range(start, position + 1):
+            flags, payload = self._payload(current)
+            if len(payload) != self.archive.frame_size:
+                raise ValueError(f"Archived frame {current} decodes to {len(payload)} bytes")
+            frame = payload if flags & KEYFRAME else _xor(payload, frame)
+
+        self._cached_position, self._cached_frame = position, frame
+        return frame
+
+    def bisect(self, timestamp):
+        """Position of the first frame recorded at or after timestamp."""
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self.timestamp(middle) < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def frames(self, start=None, end=None, step=1):
+        """Yields (timestamp, frame) for frames with start <= timestamp < end."""
+        first = 0 if start is None else self.bisect(start)
+        last = self._count if end is None else self.bisect(end)
+        for position in range(first, last, step):
+            try:
+                frame = self.frame(position)
+            except (zlib.error, ValueError, IndexError) as e:
+                logging.warning(f"Skipping unreadable archived frame {position}: {e}")
+                continue
+            yield self.timestamp(position), frame
+
+
+# Export
+
+def frame_to_image(frame, width, height):
+    return Image.frombytes('1', (width, height), frame)
+
+
+def export_png_sequence(archive, out_dir, start=None, end=None, step=1):
+    """Writes each frame in the range as a PNG. Returns the count.
+
+    Files are numbered in export order (frame_000000_<timestamp>.png), so frames recorded
+    within the same second never collide and the sequence sorts in time order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    count = 0
+    with archive.reader() as reader:
+        for timestamp, frame in reader.frames(start, end, step):
+            image = frame_to_image(frame, archive.width, archive.height)
+            image.save(os.path.join(out_dir, f"frame_{count:06d}_{timestamp:.0f}.png"))
+            count += 1
+    logging.info(f"Exported {count} frames to {out_dir}.")
+    return count
+
+
+def export_gif(archive, out_path, start=None, end=None, step=1, duration=100):
+    """Writes the frames in the range as a looping animated GIF, one frame at a time.
+
+    Unlike Image.save(save_all=True), only the current frame is held in memory.
+    Returns the number of frames written.
+    """
+    count = 0
+    with archive.reader() as reader, open(out_path, 'wb') as gif_file:
+        for _, frame in reader.frames(start, end, step):
+            image = frame_to_image(frame, archive.width, archive.height)
+            if count == 0:
+                header, _ = GifImagePlugin.getheader(image, None, {'loop': 0})
+                for chunk in header:
+                    gif_file.write(chunk)
+            for chunk in GifImagePlugin.getdata(image, (0, 0), duration=duration):
+                gif_file.write(chunk)
+            count += 1
+        # GIF trailer
+        gif_file.write(b';')
+    if count == 0:
+        os.remove(out_path)
+    logging.info(f"Exported {count} frames to {out_path}.")
+    return count
@@ -0,0 +1,142 @@
+import os
+import json
+import time
+import logging
+
+# Power states tracked for the panel
+OFF = 'off'        # never initialized, or power was lost (contents unknown)
+AWAKE = 'awake'    # initialized and powered
+ASLEEP = 'asleep'  # deep sleep after POWER_OFF, only a hardware reset wakes it
+
+# Updates between full Clear() cycles that remove ghosting
+CLEAR_EVERY_N_UPDATES = 96  # one day at one update every 15 minutes
+
+
+class PanelPower:
+    """Tracks the e-paper panel's power state and wakes it with the shortest safe sequence.
+
+    The state is kept in memory and mirrored to a JSON state file, so a process started
+    by cron knows whether the previous run left the panel in deep sleep.
+    """
+
+    def __init__(self, epd, epdconfig, state_file, clear_every=CLEAR_EVERY_N_UPDATES):
+        self.epd = epd
+        self.epdconfig = epdconfig
+        self.state_file = state_file
+        self.clear_every = clear_every
+        self.state = self._load_state()
+        # Nothing is powered by this process yet, so a panel marked awake by a previous
+        # (crashed) run still needs its GPIO and registers set up again
+        self.initialized = False
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r') as state_file:
+                state = json.load(state_file)
+        except (OSError, ValueError):
+            state = {}
+        state.setdefault('state', OFF)
+        state.setdefault('since', time.time())
+        state.setdefault('updates_since_clear', 0)
+        state.setdefault('durations', {})
+        return state
+
+    def _save_state(self):
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(self.state_file + '.tmp', 'w') as state_file:
+                json.dump(self.state, state_file)
+            os.replace(self.state_file + '.tmp', self.state_file)
+        except OSError as e:
+            logging.warning(f"Failed to save panel state: {e}")
+
+    def _set_state(self, new_state):
+        """Records the time spent in the current state and switches to new_state."""
+        now = time.time()
+        old_state = self.state['state']
+        elapsed = max(0.0, now - self.state['since'])
+        durations = self.state['durations']
+        durations[old_state] = durations.get(old_state, 0.0) + elapsed
+        self.state['state'] = new_state
+        self.state['since'] = now
+        self._save_state()
+        logging.info(f"Panel {old_state} -> {new_state} after {elapsed:.1f}s")
+
+    def _fast_reset(self):
+        # The controller only needs a few ms of reset low/high; the stock driver waits 200ms twice
+        self.epdconfig.digital_write(self.epd.reset_pin, 1)
+        self.epdconfig.delay_ms(20)
+        self.epdconfig.digital_write(self.epd.reset_pin, 0)
+        self.epdconfig.delay_ms(2)
+        self.epdconfig.digital_write(self.epd.reset_pin, 1)
+        self.epdconfig.delay_ms(20)
+
+    def wake(self):
+        """Powers the panel up if needed. Returns True if its contents are unknown."""
+        if self.initialized and self.state['state'] == AWAKE:
+            return False
+
+        previous = self.state['state']
+        start = time.perf_counter()
+        if previous == ASLEEP:
+            # Deep sleep keeps the panel contents; run the init sequence with a short reset
+            stock_reset = self.epd.reset
+            self.epd.reset = self._fast_reset
+            try:
+                result = self.epd.init()
+            finally:
+                self.epd.reset = stock_reset
+        else:
+            result = self.epd.init()
+        if result != 0:
+            raise RuntimeError("Failed to initialize the e-paper module")
+
+        self.initialized = True
+        self._set_state(AWAKE)
+        logging.info(f"Panel woken from '{previous}' in {(time.perf_counter() - start) * 1000:.0f} ms")
+        return previous == OFF
+
+    def clear_due(self):
+        return self.state['updates_since_clear'] >= self.clear_every
+
+    def display(self, frame):
+        """Wakes the panel, clears it only when ghosting cleanup is due, and shows frame."""
+        contents_unknown = self.wake()
+        if contents_unknown or self.clear_due():
+            start = time.perf_counter()
+            self.epd.Clear()
+            self.state['updates_since_clear'] = 0
+            self.state['last_clear'] = time.time()
+            logging.info(f"Panel cleared in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        self.epd.display(frame)
+        self.state['updates_since_clear'] += 1
+        self._save_state()
+
+    def sleep(self):
+        """Powers the panel off and puts it into deep sleep."""
+        if self.state['state'] != AWAKE or not self.initialized:
+            return
+        self.epd.sleep()
+        self._set_state(ASLEEP)
+        logging.info("Panel power: " + ", ".join(
+            f"{state} {seconds:.0f}s" for state, seconds in sorted(self.report().items())
+        ))
+
+    def close(self):
+        """Puts the panel to sleep and releases the GPIO and SPI devices.
+
+        The driver opens the SPI device only once per process, so call this at exit rather
+        than after each update.
+        """
+        self.sleep()
+        if self.initialized:
+            self.epd.Dev_exit()
+            self.initialized = False
+
+    def report(self):
+        """Returns the total seconds spent in each power state, including the current one."""
+        durations = dict(self.state['durations'])
+        current = self.state['state']
+        durations[current] = durations.get(current, 0.0) + max(0.0, time.time() - self.state['since'])
+        return durations
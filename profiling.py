@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import cProfile
+import pstats
+import logging
+import statistics
+import threading
+from collections import Counter
+
+# Seconds between stack samples for the collapsed-stack (flame graph) output
+SAMPLE_INTERVAL = 0.001
+
+
+class StackSampler:
+    """Samples one thread's call stack in the background and counts identical stacks.
+
+    The counts are written in the collapsed format ("outer;inner;leaf count") read by
+    flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write_collapsed(self, path):
+        with open(path, 'w') as collapsed_file:
+            for stack, count in self.stacks.most_common():
+                collapsed_file.write(f"{stack} {count}\n")
+
+
+def run_stage(name, func, repeat=1, profile=None):
+    """Runs func repeat times, logs wall-clock timings and returns the last result.
+
+    If profile is a path prefix, cProfile statistics are written to '<profile>.pstats'
+    and sampled stacks to '<profile>.collapsed', and the top functions are printed.
+    """
+    profiler = cProfile.Profile() if profile else None
+    sampler = StackSampler() if profile else None
+    timings = []
+    result = None
+
+    if sampler:
+        sampler.start()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if profiler:
+                profiler.enable()
+            try:
+                result = func()
+            finally:
+                if profiler:
+                    profiler.disable()
+                timings.append(time.perf_counter() - start)
+    finally:
+        if sampler:
+            sampler.stop()
+
+    if repeat > 1:
+        # The first run includes cold caches and imports; report it separately
+        steady = timings[1:]
+        logging.info(
+            f"Stage '{name}' x{repeat}: first {timings[0] * 1000:.1f} ms, "
+            f"steady-state min {min(steady) * 1000:.1f} ms, "
+            f"median {statistics.median(steady) * 1000:.1f} ms, max {max(steady) * 1000:.1f} ms"
+        )
+    else:
+        logging.info(f"Stage '{name}' took {timings[0] * 1000:.1f} ms")
+
+    if profile:
+        profiler.dump_stats(f"{profile}.pstats")
+        sampler.write_collapsed(f"{profile}.collapsed")
+        pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(20)
+        logging.info(f"Profile written to {profile}.pstats and {profile}.collapsed")
+
+    return result
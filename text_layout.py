@@ -0,0 +1,134 @@
+from functools import lru_cache
+from PIL import ImageFont
+
+ELLIPSIS = "..."
+
+
+@lru_cache(maxsize=64)
+def get_font(path, size):
+    """Loads a font once per (path, size) so measurements below share cache entries."""
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=4096)
+def text_width(font, text):
+    """Width in pixels of text drawn on the 1-bit canvas (same as ImageDraw.textbbox)."""
+    left, _, right, _ = font.getbbox(text, mode='1')
+    return right - left
+
+
+@lru_cache(maxsize=4096)
+def text_length(font, text):
+    """Advance width in pixels, used to lay out words side by side."""
+    return font.getlength(text, mode='1')
+
+
+@lru_cache(maxsize=64)
+def line_height(font):
+    ascent, descent = font.getmetrics()
+    return ascent + descent
+
+
+def _split_word(word, font, max_width):
+    """Breaks a word wider than max_width into pieces that fit."""
+    pieces = []
+    piece = ""
+    piece_length = 0
+    for char in word:
+        char_length = text_length(font, char)
+        if piece and piece_length + char_length > max_width:
+            pieces.append(piece)
+            piece, piece_length = "", 0
+        piece += char
+        piece_length += char_length
+    pieces.append(piece)
+    return pieces
+
+
+def wrap_text(text, font, max_width):
+    """Greedy word wrap. Returns the list of lines.
+
+    Line widths are summed from memoized word widths rather than measured as whole
+    strings, so each word is measured once per font however many lines are tried.
+    """
+    space_length = text_length(font, " ")
+    lines = []
+    line = []
+    line_length = 0
+    for word in text.split():
+        word_length = text_length(font, word)
+        if line and line_length + space_length + word_length <= max_width:
+            line.append(word)
+            line_length += space_length + word_length
+            continue
+        if line:
+            lines.append(" ".join(line))
+        if word_length <= max_width:
+            line, line_length = [word], word_length
+        else:
+            *full_pieces, last_piece = _split_word(word, font, max_width)
+            lines.extend(full_pieces)
+            line, line_length = [last_piece], text_length(font, last_piece)
+    if line:
+        lines.append(" ".join(line))
+    return lines
+
+
+def _block_height(font, line_count, spacing):
+    return line_count * line_height(font) + max(0, line_count - 1) * spacing
+
+
+def _truncate(lines, font, max_width, max_lines):
+    """Keeps the first max_lines lines and ends the last one with an ellipsis."""
+    lines = lines[:max_lines]
+    if not lines:
+        return lines
+    ellipsis_length = text_length(font, ELLIPSIS)
+    space_length = text_length(font, " ")
+    words = lines[-1].split(" ")
+    # Drop whole words, then characters, until the ellipsis fits
+    while len(words) > 1 and sum(text_length(font, word) + space_length for word in words) + ellipsis_length > max_width:
+        words.pop()
+    last = " ".join(words)
+    while last and sum(text_length(font, char) for char in last) + ellipsis_length > max_width:
+        last = last[:-1]
+    lines[-1] = last.rstrip() + ELLIPSIS
+    return lines
+
+
+def fit_text(text, font_path, sizes, max_width, max_height, spacing=2):
+    """Wraps text into a box using the largest font size that fits.
+
+    Binary-searches the sorted sizes, so only about log2(len(sizes)) wrap attempts are made.
+    If the text does not fit even at the smallest size, it is cut off with an ellipsis.
+    Returns (font, lines).
+    """
+    sizes = sorted(sizes)
+    low, high = 0, len(sizes) - 1
+    best = None
+    while low <= high:
+        middle = (low + high) // 2
+        font = get_font(font_path, sizes[middle])
+        lines = wrap_text(text, font, max_width)
+        if _block_height(font, len(lines), spacing) <= max_height:
+            best = (font, lines)
+            low = middle + 1
+        else:
+            high = middle - 1
+
+    if best is not None:
+        return best
+
+    font = get_font(font_path, sizes[0])
+    max_lines = max(1, (max_height + spacing) // (line_height(font) + spacing))
+    return font, _truncate(wrap_text(text, font, max_width), font, max_width, max_lines)
+
+
+def draw_text_box(draw, position, text, font_path, sizes, max_width, max_height, fill, spacing=2):
+    """Draws text wrapped and shrunk to fit the box whose top-left corner is position."""
+    font, lines = fit_text(text, font_path, sizes, max_width, max_height, spacing)
+    x, y = position
+    for line in lines:
+        draw.text((x, y), line, font=font, fill=fill)
+        y += line_height(font) + spacing
+    return font, lines
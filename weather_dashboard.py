@@ -1,19 +1,27 @@
 import os
 import sys
 import csv
+import json
+import atexit
+import zlib
+import hashlib
+import argparse
 import logging
 from logging.handlers import RotatingFileHandler
 from datetime import datetime, timedelta
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
 import requests
 import xml.etree.ElementTree as ET
+import feeds
+import profiling
+import panel_power
+import text_layout
+import frame_archive
 
 # Automatically add the 'lib' directory relative to the script's location
 script_dir = os.path.dirname(os.path.abspath(__file__))
 lib_path = os.path.join(os.path.dirname(__file__), 'e-Paper/RaspberryPi_JetsonNano/python/lib')
 sys.path.append(lib_path)
-from waveshare_epd import epd7in5_V2
-epd = epd7in5_V2.EPD()
 
 # User defined configuration
 try:
@@ -22,14 +30,30 @@ except ImportError:
     LOCATION = "XXXXX" # Add your location (e.g., Toronto) for it to be displayed in top right corner of dashboard
     BASE_URL = "https://dd.weather.gc.ca/citypage_weather/xml/XX/XXXXXXXXXX.xml" # Add the XML file link with your city code and province
 
+# Optional datamart feeds shown in the alerts band (leave as None to disable)
+try:
+    import config_private
+except ImportError:
+    config_private = None
+AQHI_URL = getattr(config_private, 'AQHI_URL', None) # AQHI observation XML for your community
+MARINE_URL = getattr(config_private, 'MARINE_URL', None) # Marine weather XML for your marine area
+ALERT_DETAIL_URL = getattr(config_private, 'ALERT_DETAIL_URL', None) # CAP alert file or ATOM alert feed for your region
+
 FONT_DIR = os.path.join(os.path.dirname(__file__), 'font')
 ICON_DIR = os.path.join(os.path.dirname(__file__), 'icons')
+CACHE_DIR = os.path.join(os.path.dirname(__file__), 'cache')
+PANEL_STATE_FILE = os.path.join(CACHE_DIR, 'panel_state.json')
+CLEAR_EVERY_N_UPDATES = panel_power.CLEAR_EVERY_N_UPDATES # set a number to change how often the display is fully cleared
 CSV_OPTION = True # if csv_option == True, a weather data will be appended to 'record.cs
+ARCHIVE_OPTION = True # if True, every displayed frame is appended to the time-lapse archive in ARCHIVE_DIR
+ARCHIVE_DIR = os.path.join(os.path.dirname(__file__), 'archive')
+
+# Panel resolution (7.5-inch screen size is 800x480 pixels for this model)
+DISPLAY_WIDTH = 800
+DISPLAY_HEIGHT = 480
 
-# Initialize display
-epd = epd7in5_V2.EPD()
-epd.init()
-epd.Clear()
+# The display is initialized on first use so stages that don't touch the panel run anywhere
+panel = None
 
 # Logging configuration for both file and console
 LOG_FILE = os.path.join(os.path.dirname(__file__), 'weather_dashboard_activity.log')
@@ -50,23 +74,55 @@ logger.info("Weather display script started.")
 
 # Set fonts with specific sizes to match the old behavior
 FONT_PATH = os.path.join(FONT_DIR, 'Font.ttc')
-FONTS = {size: ImageFont.truetype(FONT_PATH, size) for size in [18, 20, 22, 30, 80]}
+FONTS = {size: text_layout.get_font(FONT_PATH, size) for size in [18, 20, 22, 30, 80]}
 COLORS = {'black': 'rgb(0,0,0)', 'white': 'rgb(255,255,255)', 'grey': 'rgb(235,235,235)'}
 
-# Fetch weather data
-def fetch_weather_data():
-    url = BASE_URL
+# Fixed layout drawn once into the static layer; bump the version whenever it changes
+STATIC_LAYER_VERSION = 1
+RIGHT_PADDING = 25 # px from the right edge for right-aligned header text
+SMALL_ICON_SIZE = (35, 35)
+SMALL_ICONS = {
+    'wind_speed': ("wind_icon.png", (40, 420)),
+    'humidity': ("humidity_icon.png", (40, 270)),
+    'sunrise_time': ("sunrise_icon.png", (40, 320)),
+    'sunset_time': ("sunset_icon.png", (40, 370)),
+}
+
+# Alerts band between the current conditions and the forecast, left of the hourly column
+ALERT_BOX = (45, 210, 550, 55) # x, y, width, height
+ALERT_FONT_SIZES = range(12, 19) # shrink from FONTS[18] until the alerts fit
+
+# Current condition description below the wind chill, left of the hourly column
+CONDITION_BOX = (240, 155, 360, 45) # x, y, width, height
+CONDITION_FONT_SIZES = range(16, 23) # shrink from FONTS[22] until the condition fits
+
+# Register datamart feeds with how long (in seconds) each cached copy stays fresh
+feeds.register_feed('citypage', BASE_URL, feeds.parse_citypage, ttl=10 * 60, required=True)
+feeds.register_feed('aqhi', AQHI_URL, feeds.parse_aqhi, ttl=60 * 60)
+feeds.register_feed('marine', MARINE_URL, feeds.parse_marine, ttl=60 * 60)
+feeds.register_feed('alert_details', ALERT_DETAIL_URL, feeds.parse_alert_details, ttl=10 * 60)
+
+# Fetch all due feeds concurrently
+def fetch_feed_data(use_cache=True):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        root = ET.fromstring(response.content)
-        
+        feed_data = feeds.fetch_feeds(CACHE_DIR, use_cache=use_cache)
         logging.info("Weather data fetched successfully.")
-        return root
-    except requests.RequestException as e:
+        return feed_data
+    except (requests.RequestException, ET.ParseError) as e:
         logging.error(f"Failed to fetch weather data: {e}")
         raise
 
+# Fetch weather data
+def fetch_weather_data(use_cache=True):
+    return fetch_feed_data(use_cache)['citypage']
+
+def merge_feed_data(current_data, feed_data):
+    """Adds the optional feeds' values to the current conditions for the alerts band."""
+    current_data["aqhi"] = feed_data.get('aqhi')
+    current_data["marine_warnings"] = feed_data.get('marine') or []
+    current_data["alert_details"] = feed_data.get('alert_details') or []
+    return current_data
+
 # Process weather data
 def process_weather_data(root):
     try:
@@ -291,34 +347,92 @@ def save_to_csv(current_data, hourly_forecast_data):
     except IOError as e:
         logging.error(f"Failed to save data to CSV: {e}")
 
+# In-memory copies of the static layer, keyed by configuration
+_static_layers = {}
+
+def static_layer_key():
+    """Identifies the static layer for the current location, fonts, icons and layout version."""
+    parts = [str(STATIC_LAYER_VERSION), LOCATION, f"{DISPLAY_WIDTH}x{DISPLAY_HEIGHT}", FONT_PATH, str(os.path.getmtime(FONT_PATH))]
+    parts += [str(size) for size in sorted(FONTS)]
+    for icon_file, pos in SMALL_ICONS.values():
+        parts += [icon_file, str(pos), str(os.path.getmtime(os.path.join(ICON_DIR, icon_file)))]
+    return hashlib.sha1("|".join(parts).encode()).hexdigest()[:16]
+
+def render_static_layer():
+    """Draws the parts of the frame that do not depend on the weather data."""
+    template = Image.new('1', (DISPLAY_WIDTH, DISPLAY_HEIGHT), 255)
+    draw = ImageDraw.Draw(template)
+
+    # Right-aligned location below the last update time
+    location_width = text_layout.text_width(FONTS[30], LOCATION)
+    draw.text((DISPLAY_WIDTH - RIGHT_PADDING - location_width, 60), LOCATION, font=FONTS[30], fill=COLORS['black'])
+
+    # Wind, humidity, sunrise and sunset icons
+    for icon_file, pos in SMALL_ICONS.values():
+        icon = Image.open(os.path.join(ICON_DIR, icon_file)).resize(SMALL_ICON_SIZE)
+        template.paste(icon, pos)
+
+    return template
+
+def get_static_layer():
+    """Returns the static layer from memory, the packed file in CACHE_DIR, or renders it."""
+    key = static_layer_key()
+    if key in _static_layers:
+        return _static_layers[key]
+
+    size = (DISPLAY_WIDTH, DISPLAY_HEIGHT)
+    layer_path = os.path.join(CACHE_DIR, f"static_layer_{key}.bin")
+    try:
+        with open(layer_path, 'rb') as layer_file:
+            layer = Image.frombytes('1', size, layer_file.read())
+    except (OSError, ValueError):
+        layer = render_static_layer()
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            # Packed 1-bit rows, 8 pixels per byte
+            with open(layer_path + '.tmp', 'wb') as layer_file:
+                layer_file.write(layer.tobytes())
+            os.replace(layer_path + '.tmp', layer_path)
+            logging.info("Static layer rendered and cached.")
+        except OSError as e:
+            logging.warning(f"Failed to cache static layer: {e}")
+
+    _static_layers[key] = layer
+    return layer
+
+def format_alert_text(current_data):
+    """Builds the alerts band text from the citypage warnings and the optional feeds."""
+    # Prefer the alert detail headlines over the short citypage descriptions
+    alerts = ", ".join(current_data.get('alert_details') or []) or current_data['alerts']
+    alert_text = f"Alert(s): {alerts}" if alerts else "No active alerts"
+    if current_data.get('marine_warnings'):
+        alert_text += f" | Marine: {', '.join(current_data['marine_warnings'])}"
+    if current_data.get('aqhi') is not None:
+        alert_text += f" | AQHI: {current_data['aqhi']:.0f}"
+    return alert_text
+
 def generate_display_image(current_data, forecast_data, hourly_forecast_data):
     try:
-        # Create a blank canvas (7.5-inch screen size is 800x480 pixels for this model)
-        template = Image.new('1', (epd.width, epd.height), 255)
+        # Start from a copy of the static layer
+        template = get_static_layer().copy()
         draw = ImageDraw.Draw(template)
 
-        # Set icon size
-        icon_size = (35, 35)
-
         # Extract and format the last update time
         date_time_str = current_data['full_date']
         date_time_obj = datetime.strptime(date_time_str, "%m/%d/%Y %H:%M")
         formatted_date_time = date_time_obj.strftime("%m/%d/%Y %I:%M %p").lower()
 
         # Get text width to right-align elements
-        date_time_bbox = draw.textbbox((0, 0), formatted_date_time, font=FONTS[30])
-        date_time_width = date_time_bbox[2] - date_time_bbox[0]
-        x_position = epd.width  - 25  # 25px padding from the right edge
+        date_time_width = text_layout.text_width(FONTS[30], formatted_date_time)
+        x_position = DISPLAY_WIDTH - RIGHT_PADDING
 
-        # Draw the last update time and location
+        # Draw the last update time (the location is part of the static layer)
         draw.text((x_position - date_time_width, 25), formatted_date_time, font=FONTS[30], fill=COLORS['black'])
-        location_bbox = draw.textbbox((0, 0), LOCATION, font=FONTS[30])
-        location_width = location_bbox[2] - location_bbox[0]
-        draw.text((x_position - location_width, 60), LOCATION, font=FONTS[30], fill=COLORS['black'])
 
-        # Display weather alerts
-        alert_text = f"Alert(s): {current_data['alerts']}" if current_data['alerts'] else "No active alerts"
-        draw.text((45, 210), alert_text, font=FONTS[18], fill=COLORS['black'])        
+        # Display weather alerts, wrapped and shrunk to fit the alerts band
+        alert_text = format_alert_text(current_data)
+        x, y, width, height = ALERT_BOX
+        text_layout.draw_text_box(draw, (x, y), alert_text, FONT_PATH, ALERT_FONT_SIZES, width, height, fill=COLORS['black'])
 
         # Load and display current weather icon
         icon_path = os.path.join(ICON_DIR, f"{current_data['icon_code']}.png")
@@ -334,29 +448,20 @@ def generate_display_image(current_data, forecast_data, hourly_forecast_data):
         if wind_chill is not None:
             draw.text((240, 110), f"Wind chill: {float(wind_chill):.0f}°C", font=FONTS[30], fill=COLORS['black'])
 
-        # Display weather condition description
+        # Display weather condition description, wrapped and shrunk to fit its box
         if current_data['condition'] is not None:
-            draw.text((240, 155), f"{current_data['condition']}", font=FONTS[22], fill=COLORS['black'])
-
-        # Display wind and humidity icons and values
-        for icon_file, pos, key, unit in [
-            ("wind_icon.png", (40, 420), 'wind_speed', " km/h"),
-            ("humidity_icon.png", (40, 270), 'humidity', "%")
-        ]:
-            icon = Image.open(os.path.join(ICON_DIR, icon_file)).resize(icon_size)
-            template.paste(icon, pos)
+            x, y, width, height = CONDITION_BOX
+            text_layout.draw_text_box(draw, (x, y), f"{current_data['condition']}", FONT_PATH, CONDITION_FONT_SIZES, width, height, fill=COLORS['black'])
 
+        # Display wind and humidity values next to their icons
+        for key, unit in [('wind_speed', " km/h"), ('humidity', "%")]:
+            pos = SMALL_ICONS[key][1]
             if current_data[key] is not None:
                 draw.text((pos[0] + 40, pos[1]), f"{float(current_data[key]):.1f}{unit}", font=FONTS[22], fill=COLORS['black'])
 
-        # Display sunrise and sunset times
-        for icon_file, pos, key in [
-            ("sunrise_icon.png", (40, 320), 'sunrise_time'),
-            ("sunset_icon.png", (40, 370), 'sunset_time')
-        ]:
-            icon = Image.open(os.path.join(ICON_DIR, icon_file)).resize(icon_size)
-            template.paste(icon, pos)
-    
+        # Display sunrise and sunset times next to their icons
+        for key in ['sunrise_time', 'sunset_time']:
+            pos = SMALL_ICONS[key][1]
             if current_data[key] is not None:
                 draw.text((pos[0] + 40, pos[1]), current_data[key], font=FONTS[22], fill=COLORS['black'])
 
@@ -430,28 +535,200 @@ def generate_display_image(current_data, forecast_data, hourly_forecast_data):
         raise
 
 
+def get_panel():
+    """Imports the panel driver on first use and returns its power manager."""
+    global panel
+    if panel is None:
+        from waveshare_epd import epd7in5_V2, epdconfig
+        panel = panel_power.PanelPower(epd7in5_V2.EPD(), epdconfig, PANEL_STATE_FILE, clear_every=CLEAR_EVERY_N_UPDATES)
+        # The SPI device is opened once per process, so only release it when the process exits
+        atexit.register(close_display)
+    return panel
+
+def sleep_display():
+    """Puts the panel into deep sleep after an update, if it was used."""
+    if panel is None:
+        return
+    try:
+        panel.sleep()
+    except Exception as e:
+        logging.error(f"Failed to put e-paper to sleep: {e}")
+
+def close_display():
+    """Puts the panel into deep sleep and releases its GPIO and SPI devices."""
+    if panel is None:
+        return
+    try:
+        panel.close()
+    except Exception as e:
+        logging.error(f"Failed to release e-paper: {e}")
+
+def pack_frame(image):
+    """Packs an image into the panel's frame buffer layout (1 bit per pixel, MSB first, 1 = white).
+
+    Produces the same bytes as EPD.getbuffer() for an upright 800x480 image, without a
+    Python loop over every pixel.
+    """
+    h_image = Image.new('1', (DISPLAY_WIDTH, DISPLAY_HEIGHT), 255)
+    h_image.paste(image.convert('1'), (0, 0))
+    return h_image.tobytes()
+
+def push_frame(frame):
+    """Sends a packed frame to the panel and refreshes it."""
+    if len(frame) != DISPLAY_WIDTH * DISPLAY_HEIGHT // 8:
+        raise ValueError(f"Packed frame is {len(frame)} bytes, expected {DISPLAY_WIDTH * DISPLAY_HEIGHT // 8}")
+    get_panel().display(frame)
+
+def get_frame_archive():
+    return frame_archive.FrameArchive(os.path.join(ARCHIVE_DIR, 'frames'), DISPLAY_WIDTH, DISPLAY_HEIGHT)
+
+def archive_frame(frame):
+    """Appends a displayed frame to the time-lapse archive."""
+    if not ARCHIVE_OPTION:
+        return
+    try:
+        get_frame_archive().append(datetime.now().timestamp(), frame)
+        logging.info("Frame appended to archive.")
+    except (OSError, ValueError, zlib.error) as e:
+        logging.error(f"Failed to archive frame: {e}")
+
 # Display image on screen
 def display_image(image):
     try:
-        h_image = Image.new('1', (epd.width, epd.height), 255)
-        h_image.paste(image, (0, 0))
-        epd.display(epd.getbuffer(h_image))
+        frame = pack_frame(image)
+        push_frame(frame)
         logging.info("Image displayed on e-paper successfully.")
     except Exception as e:
         logging.error(f"Failed to display image: {e}")
         raise
+    archive_frame(frame)
 
 
 # Main function
-def main():
+def main(use_cache=True):
     try:
-        data = fetch_weather_data()
-        current_data, forecast_data, hourly_forecast_data  = process_weather_data(data)
+        feed_data = fetch_feed_data(use_cache)
+        current_data, forecast_data, hourly_forecast_data  = process_weather_data(feed_data['citypage'])
+        merge_feed_data(current_data, feed_data)
         save_to_csv(current_data, hourly_forecast_data)
         image = generate_display_image(current_data, forecast_data, hourly_forecast_data)
         display_image(image)
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
+    finally:
+        sleep_display()
+
+# Command line stages, so each part of the cycle can be run and profiled on its own
+def load_weather_xml(path):
+    return ET.parse(path).getroot()
+
+def stage_fetch(args):
+    # Bypass the TTL caches by default so --repeat times real downloads
+    root = fetch_weather_data(use_cache=args.cached)
+    if args.out:
+        ET.ElementTree(root).write(args.out, encoding='utf-8', xml_declaration=True)
+    return root
+
+def stage_parse(args):
+    current_data, forecast_data, hourly_forecast_data = process_weather_data(load_weather_xml(args.file))
+    return {"current": current_data, "forecast": forecast_data, "hourly_forecast": hourly_forecast_data}
+
+def stage_render(args):
+    current_data, forecast_data, hourly_forecast_data = process_weather_data(load_weather_xml(args.file))
+    merge_feed_data(current_data, {})
+    image = generate_display_image(current_data, forecast_data, hourly_forecast_data)
+    if args.png:
+        image.save(args.png)
+    return image
+
+def stage_pack(args):
+    frame = pack_frame(Image.open(args.image))
+    with open(args.out, 'wb') as frame_file:
+        frame_file.write(frame)
+    return frame
+
+def stage_push(args):
+    with open(args.frame, 'rb') as frame_file:
+        frame = frame_file.read()
+    try:
+        push_frame(frame)
+    finally:
+        sleep_display()
+    logging.info("Frame pushed to e-paper successfully.")
+
+def stage_cycle(args):
+    # Like the fetch stage, bypass the TTL caches by default so --repeat times real downloads
+    main(use_cache=args.cached)
+
+def parse_datetime(value):
+    return datetime.fromisoformat(value).timestamp()
+
+def stage_export(args):
+    archive = get_frame_archive()
+    if args.gif:
+        return frame_archive.export_gif(archive, args.gif, args.start, args.end, args.step, args.duration)
+    return frame_archive.export_png_sequence(archive, args.png_dir, args.start, args.end, args.step)
+
+def cli(argv=None):
+    parser = argparse.ArgumentParser(description="Weather dashboard for the Waveshare 7.5 inch e-paper display.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--profile', metavar='PREFIX', help="write PREFIX.pstats and PREFIX.collapsed (flame graph stacks)")
+    common.add_argument('--repeat', type=int, default=1, metavar='N', help="run the stage N times for steady-state timing")
+    subparsers = parser.add_subparsers(dest='command')
+
+    fetch_parser = subparsers.add_parser('fetch', parents=[common], help="fetch the datamart feeds")
+    fetch_parser.add_argument('--out', help="save the citypage XML to this file")
+    fetch_parser.add_argument('--cached', action='store_true', help="serve feeds from the cache while their TTL allows")
+    fetch_parser.set_defaults(stage=stage_fetch)
+
+    parse_parser = subparsers.add_parser('parse', parents=[common], help="parse a saved citypage XML file")
+    parse_parser.add_argument('file')
+    parse_parser.set_defaults(stage=stage_parse)
+
+    render_parser = subparsers.add_parser('render', parents=[common], help="render a saved citypage XML file")
+    render_parser.add_argument('file')
+    render_parser.add_argument('--png', help="save the rendered frame as a PNG")
+    render_parser.set_defaults(stage=stage_render)
+
+    pack_parser = subparsers.add_parser('pack', parents=[common], help="pack an image into a panel frame buffer")
+    pack_parser.add_argument('image')
+    pack_parser.add_argument('--out', default='frame.bin', help="packed frame output (default: frame.bin)")
+    pack_parser.set_defaults(stage=stage_pack)
+
+    push_parser = subparsers.add_parser('push', parents=[common], help="send a packed frame to the panel")
+    push_parser.add_argument('frame')
+    push_parser.set_defaults(stage=stage_push)
+
+    cycle_parser = subparsers.add_parser('cycle', parents=[common], help="fetch, render and display (default)")
+    cycle_parser.add_argument('--cached', action='store_true', help="serve feeds from the cache while their TTL allows, as cron runs do")
+    cycle_parser.set_defaults(stage=stage_cycle)
+
+    export_parser = subparsers.add_parser('export', parents=[common], help="export archived frames as a GIF or PNG sequence")
+    output = export_parser.add_mutually_exclusive_group(required=True)
+    output.add_argument('--gif', help="animated GIF output")
+    output.add_argument('--png-dir', help="directory for a PNG sequence")
+    export_parser.add_argument('--start', type=parse_datetime, help="first time to include, e.g. 2025-01-01 or 2025-01-01T06:00")
+    export_parser.add_argument('--end', type=parse_datetime, help="time to stop before")
+    export_parser.add_argument('--step', type=int, default=1, help="keep every Nth frame (default: 1)")
+    export_parser.add_argument('--duration', type=int, default=100, help="GIF frame duration in ms (default: 100)")
+    export_parser.set_defaults(stage=stage_export)
+
+    args = parser.parse_args(argv)
+    if args.command is None:
+        # Plain `python weather_dashboard.py` keeps running a full cycle
+        main()
+        return 0
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    try:
+        result = profiling.run_stage(args.command, lambda: args.stage(args), repeat=args.repeat, profile=args.profile)
+    except Exception as e:
+        logging.error(f"Stage '{args.command}' failed: {e}")
+        return 1
+    if args.command == 'parse':
+        print(json.dumps(result, indent=2))
+    return 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(cli())